@@ -3,45 +3,62 @@
 
 import os
 import io
+import sys
 import random
+import struct
 import argparse
-from pathlib import Path
+import functools
+import contextlib
+import contextvars
+from collections import deque
 from importlib import metadata
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pprint import pprint as pretty_print
-from PIL import Image, ImageEnhance, ImageFilter
+from PIL import Image, ImageEnhance, ImageFilter, ImageStat
 import pypdfium2 as pdfium
 from colorama import Fore, Style, init
 
-SUPPORTED_IMAGES = ["jpg", "png", "jpeg", "webp"]
-SUPPORTED_DOCS = ["pdf", "PDF"]
+SUPPORTED_IMAGES = frozenset({"jpg", "png", "jpeg", "webp"})
+SUPPORTED_DOCS = frozenset({"pdf"})
 CHOICES = ["y", "yes", "n", "no", "true", "false"]
+# Brightness boost steps randomly applied to rendered pdf pages
+BRIGHTNESS_STEPS = (1.01, 1.0125, 1.015, 1.0175, 1.02)
+# Terminal colors available to print_color
+COLOR_MAP = {
+    "black": Fore.BLACK,
+    "red": Fore.RED,
+    "green": Fore.GREEN,
+    "yellow": Fore.YELLOW,
+    "blue": Fore.BLUE,
+    "magenta": Fore.MAGENTA,
+    "cyan": Fore.CYAN,
+    "white": Fore.WHITE,
+}
+# Set while quiet mode silences stdout, so that errors are printed to stderr instead
+_ERRORS_TO_STDERR = contextvars.ContextVar("errors_to_stderr", default=False)
 
 
 def print_color(text, color):
     """
     Print the specified text in the given color.
     Available colors: 'black', 'red', 'green', 'yellow', 'blue', 'magenta', 'cyan', 'white'.
+    Red text reports errors, so in quiet mode it's printed to stderr, where it still shows.
     """
-    color_map = {
-        "black": Fore.BLACK,
-        "red": Fore.RED,
-        "green": Fore.GREEN,
-        "yellow": Fore.YELLOW,
-        "blue": Fore.BLUE,
-        "magenta": Fore.MAGENTA,
-        "cyan": Fore.CYAN,
-        "white": Fore.WHITE,
-    }
-    color_code = color_map.get(color.lower(), Fore.RESET)
-    print(color_code + text + Style.RESET_ALL)
+    color_code = COLOR_MAP.get(color.lower(), Fore.RESET)
+    is_error = color.lower() == "red"
+    file = sys.stderr if is_error and _ERRORS_TO_STDERR.get() else sys.stdout
+    print(color_code + text + Style.RESET_ALL, file=file)
 
 
 # Initialize colorama
 init()
 
 
-def parse_args():
-    """Parse input command-line arguments for the script"""
+def parse_args(argv=None):
+    """
+    Parse input command-line arguments for the script.
+    Arguments are read from sys.argv unless an argument list is given.
+    """
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "-i",
@@ -132,7 +149,41 @@ def parse_args():
     A factor of 1.0 gives the original image. \
     Greater values increase the brightness of the image",
     )
-    return parser.parse_args()
+    parser.add_argument(
+        "-o",
+        "--optimize",
+        type=str.lower,
+        choices=CHOICES,
+        default="yes",
+        help="Save output pages as optimized, progressive JPEGs.\
+    Output files are smaller but take a little longer to convert (default: yes)",
+    )
+    parser.add_argument(
+        "-rs",
+        "--render_scale",
+        type=_render_scale,
+        help="The scale pdf pages are rendered at before they are scanned.\
+    Valid range - 1.0 to 3.0. Higher values keep more detail but take longer\
+    to convert and give bigger files (default: 2.0 for quality 85 and above,\
+    1.5 for quality 65 and above, 1.0 below that)",
+    )
+    parser.add_argument(
+        "-qt",
+        "--quiet",
+        type=str.lower,
+        choices=CHOICES,
+        default="no",
+        help="Only print errors, without progress and summary messages (default: no)",
+    )
+    return parser.parse_args(argv)
+
+
+def _render_scale(value):
+    """Argument type for the pdf render scale, a number from 1.0 to 3.0"""
+    scale = float(value)
+    if not 1.0 <= scale <= 3.0:
+        raise argparse.ArgumentTypeError(f"{value} is not between 1.0 and 3.0")
+    return scale
 
 
 def get_input_folder(args):
@@ -194,6 +245,26 @@ def get_brightness(args):
     return args.brightness
 
 
+def get_optimize(args):
+    """Return if output pages should be saved as optimized JPEGs"""
+    return _is_true(args.optimize)
+
+
+def get_render_scale(args):
+    """
+    Return the pdf render scale from command-line argument.
+    If argument not provided, returns the scale that fits the output quality
+    """
+    if args.render_scale:
+        return args.render_scale
+    return _get_render_scale(args.file_quality)
+
+
+def get_quiet(args):
+    """Return if only errors should be printed"""
+    return _is_true(args.quiet)
+
+
 def get_sort_key(args):
     """Return the key with which files should be sorted and then coverted"""
     sort_by = args.sort_by.lower().strip()
@@ -203,15 +274,19 @@ def get_sort_key(args):
 def get_file_type(args):
     """Get file type and supported documents based on input arguments"""
     if args.file_type_or_name:
-        file_type = args.file_type_or_name.lower()
+        file_type = args.file_type_or_name.lower().lstrip(".")
         if file_type == "image":
             return "image", SUPPORTED_IMAGES
-        if any(
-            f.endswith(file_type) or file_type.endswith(f) for f in SUPPORTED_IMAGES
-        ):
-            return "image", [args.file_type_or_name]
-        if any(f.endswith(file_type) or file_type.endswith(f) for f in SUPPORTED_DOCS):
-            return "pdf", [args.file_type_or_name]
+        # Input is either a file type like "png" or a file name like "scan.png"
+        extension = file_type.rpartition(".")[2]
+        if extension == file_type:
+            file_type_list = [extension]
+        else:
+            file_type_list = [args.file_type_or_name]
+        if extension in SUPPORTED_IMAGES:
+            return "image", file_type_list
+        if extension in SUPPORTED_DOCS:
+            return "pdf", file_type_list
     # if none of the above scenarios match, default to PDFs
     print("Defaulting to find pdf files")
     return "pdf", SUPPORTED_DOCS
@@ -242,44 +317,84 @@ def files_exists(file_path):
     return False
 
 
-def reduce_image_quality(image, quality=100, compression="JPEG"):
-    """Reduce quality of a given image object"""
+def _get_subsampling(quality):
+    """
+    Return the JPEG chroma subsampling to use for the given quality.
+    4:2:2 keeps more color detail for high quality output, 4:2:0 halves the chroma data otherwise.
+    """
+    return 1 if quality >= 95 else 2
+
+
+def _change_image_to_byte_buffer(image, quality=95, optimize=False, compression="JPEG"):
+    """
+    Save the image data in memory and return the encoded bytes.
+    Bytes are cheaper than a file-like object to send back from worker processes.
+    With optimize, JPEGs get optimal Huffman tables and progressive encoding,
+    which makes them a few percent smaller at the cost of a slower encode.
+    """
     img_byte_array = io.BytesIO()
-    # Save the image to the in-memory file object
-    image.save(img_byte_array, quality=quality, format=compression)
+    image.save(
+        img_byte_array,
+        quality=quality,
+        subsampling=_get_subsampling(quality),
+        optimize=optimize,
+        progressive=optimize,
+        format=compression,
+    )
+    # getvalue shares the buffer instead of copying it
+    return img_byte_array.getvalue()
+
 
-    # Rewind the file object to the beginning
-    img_byte_array.seek(0)
-    # Open the image from the in-memory file object
-    reduced_image = Image.open(img_byte_array)
-    return reduced_image
+def reduce_image_quality(image, quality=100, compression="JPEG"):
+    """
+    Reduce quality of a given image object.
+    The image is encoded the same way as scanned pages, then opened again from memory.
+    """
+    image_data = _change_image_to_byte_buffer(image, quality, compression=compression)
+    return Image.open(io.BytesIO(image_data))
 
 
-def _change_image_to_byte_buffer(image, compression="JPEG"):
+def flatten_image(image):
     """
-    Save the image data to an in-memory file-like object
+    Return PIL Image object in RGB mode.
+    Transparent areas are placed on a white background, like on a sheet of paper.
     """
-    img_byte_array = io.BytesIO()
-    image.save(img_byte_array, quality=95, format=compression)
-    # Reset the file position to the beginning
-    img_byte_array.seek(0)
-    return img_byte_array
+    if image.mode == "P" and "transparency" in image.info:
+        image = image.convert("RGBA")
+    if image.mode in ("RGBA", "LA", "PA"):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, "white")
+        background.paste(image, mask=image)
+        return background
+    return image.convert("RGB")
 
 
 def rotate_image(image, angle):
-    """Rotate PIL Image object with given angle value"""
+    """
+    Rotate PIL Image object with given angle value.
+    Only small tilts are applied, so bilinear sampling is enough and the image
+    keeps its size; the uncovered corners are filled with white.
+    """
     rotated_image = image.rotate(
-        angle, resample=Image.Resampling.BICUBIC, expand=True, fillcolor=(255, 255, 255)
+        angle, resample=Image.Resampling.BILINEAR, expand=False, fillcolor="white"
     )
     return rotated_image
 
 
-def black_and_white_image(image):
-    """Make image black and white like a photocopy"""
-    bw_image = image.convert("L")
+def black_and_white_image(image, brightness=1.0):
+    """
+    Make image black and white like a photocopy.
+    A brightness factor can be applied as part of the grayscale conversion.
+    """
+    if brightness != 1.0 and image.mode == "RGB":
+        # ITU-R 601-2 luma weights, scaled by the brightness factor
+        matrix = (0.299 * brightness, 0.587 * brightness, 0.114 * brightness, 0)
+        bw_image = image.convert("L", matrix)
+    else:
+        bw_image = image if image.mode == "L" else image.convert("L")
+        bw_image = change_brightness(bw_image, brightness)
     # Adjust the contrast level
-    enhancer = ImageEnhance.Contrast(bw_image)
-    bw_image = enhancer.enhance(random.uniform(1.2, 1.5))
+    bw_image = change_contrast(bw_image, random.uniform(1.2, 1.5))
     return bw_image
 
 
@@ -289,9 +404,43 @@ def blur_image(image):
     return blurred_image
 
 
-def change_contrast(image, contrast_factor):
-    """Change contrast of a PIL Image object"""
-    return ImageEnhance.Contrast(image).enhance(contrast_factor)
+def _to_float32(value):
+    """Round a Python float to single precision"""
+    return struct.unpack("f", struct.pack("f", value))[0]
+
+
+def _blend_level(start, end, factor):
+    """
+    Return the pixel level Image.blend computes between two levels for the given factor.
+    Pillow blends in single precision and truncates the result, so the same is done here.
+    """
+    level = _to_float32(start + _to_float32(_to_float32(factor) * (end - start)))
+    return max(0, min(255, int(level)))
+
+
+def _contrast_lut(mean, contrast_factor, brightness_factor, bands):
+    """
+    Return a lookup table for Image.point that applies ImageEnhance.Contrast
+    around the given mean, followed by ImageEnhance.Brightness.
+    Levels are rounded like Pillow rounds them, so the output matches both enhancers.
+    """
+    lut = []
+    for value in range(256):
+        value = _blend_level(mean, value, contrast_factor)
+        lut.append(_blend_level(0, value, brightness_factor))
+    return lut * bands
+
+
+def change_contrast(image, contrast_factor, brightness_factor=1.0):
+    """
+    Change contrast of a PIL Image object.
+    A brightness factor can be applied in the same pass, with the same result
+    as ImageEnhance.Contrast followed by ImageEnhance.Brightness.
+    """
+    grayscale = image if image.mode == "L" else image.convert("L")
+    mean = int(ImageStat.Stat(grayscale).mean[0] + 0.5)
+    lut = _contrast_lut(mean, contrast_factor, brightness_factor, len(image.getbands()))
+    return image.point(lut)
 
 
 def change_sharpness(image, sharpness_factor):
@@ -299,88 +448,302 @@ def change_sharpness(image, sharpness_factor):
     return ImageEnhance.Sharpness(image).enhance(sharpness_factor)
 
 
+@functools.lru_cache(maxsize=None)
+def _brightness_lut(factor, bands):
+    """
+    Return a lookup table for Image.point that multiplies every band by the given factor,
+    with the same rounding as ImageEnhance.Brightness.
+    Tables are cached, so pages sharing a brightness factor reuse the same table.
+    """
+    return [_blend_level(0, value, factor) for value in range(256)] * bands
+
+
 def change_brightness(image, brightness_factor):
     """Change brightness of a PIL Image object"""
-    return ImageEnhance.Brightness(image).enhance(brightness_factor)
+    if brightness_factor == 1.0:
+        return image
+    return image.point(_brightness_lut(brightness_factor, len(image.getbands())))
+
+
+def _has_effects(askew, black_and_white, blur, contrast, sharpness, brightness):
+    """Return True if any of the scan effects would change the image"""
+    return (
+        askew
+        or black_and_white
+        or blur
+        or contrast != 1.0
+        or sharpness != 1.0
+        or brightness != 1.0
+    )
 
 
-def _convert_pdf_pages_to_jpg_list(
-    pdf_path,
-    image_quality=100,
-    askew=True,
-    black_and_white=False,
-    blur=False,
-    contrast=1.0,
-    sharpness=1.0,
-    brightness=1.0,
+def _apply_effects(
+    image,
+    askew,
+    black_and_white,
+    blur,
+    contrast,
+    sharpness,
+    brightness,
+    max_angle=0.75,
+    brightness_boost=1.0,
 ):
     """
-    Reads given pdf file and reads all pages and converts them to image objects
+    Apply the requested scan effects to a PIL Image object.
+    Black and white conversion runs first, so that every following step
+    only has to process a single channel instead of three.
+    The brightness boost only scales pixel values, so instead of taking a pass of
+    its own it is folded into the black and white conversion or the brightness step.
     """
-    images_list = []
-    doc = pdfium.PdfDocument(pdf_path)
+    # Make image black and white like a photocopy
+    if black_and_white:
+        image = black_and_white_image(image, brightness_boost)
+    else:
+        brightness *= brightness_boost
+
+    # Rotate every image by a small random angle
+    if askew:
+        image = rotate_image(image, random.uniform(-max_angle, max_angle))
+
+    # Make image blurry
+    if blur:
+        image = blur_image(image)
+
+    # change image contrast, together with the brightness when nothing runs in between
+    if contrast != 1.0:
+        if sharpness == 1.0:
+            image = change_contrast(image, contrast, brightness)
+            brightness = 1.0
+        else:
+            image = change_contrast(image, contrast)
+
+    # change image sharpness
+    if sharpness != 1.0:
+        image = change_sharpness(image, sharpness)
+
+    # change image brightness
+    if brightness != 1.0:
+        image = change_brightness(image, brightness)
+
+    return image
 
+
+def _get_render_scale(image_quality):
+    """
+    Return the pdf page render scale for the given output quality.
+    Lower quality output can't keep the detail of a high resolution render,
+    so fewer pixels are rendered and encoded for it.
+    """
+    if image_quality >= 85:
+        return 2.0
+    if image_quality >= 65:
+        return 1.5
+    return 1.0
+
+
+def _open_pdf(pdf_path):
+    """Open a pdf document with its form fields ready to be rendered"""
+    doc = pdfium.PdfDocument(pdf_path)
     # If pdf contains forms, initiate form fields to render on output
     if doc.get_formtype():
         doc.init_forms()
+    return doc
 
-    for page in doc:
-        # increase render resolution for better scanned image quality
-        bitmap = page.render(scale=2)
-        image = bitmap.to_pil()
+
+def _render_page(page, render_scale, black_and_white):
+    """
+    Render a single pdf page and return its pdfium bitmap together with a PIL Image object.
+    The image can share memory with the bitmap, so the caller closes the bitmap
+    once the image is no longer used, on the thread that rendered it.
+    """
+    # increase render resolution for better scanned image quality
+    # RGBX and grayscale bitmaps are shared with PIL instead of being copied,
+    # so render straight to grayscale for black and white output, RGBX otherwise
+    bitmap = page.render(
+        scale=render_scale,
+        grayscale=black_and_white,
+        rev_byteorder=True,
+        prefer_bgrx=True,
+        # pdfium owns the buffer, so closing the bitmap frees it right away
+        bitmap_maker=pdfium.PdfBitmap.new_foreign,
+    )
+    image = bitmap.to_pil()
+    if image.mode not in ("RGBX", "L"):
         image = image.convert("RGB")
+    return bitmap, image
 
-        # Reduce image quality a little bit
-        image = reduce_image_quality(image, image_quality)
 
-        # increase brightness a little bit
-        enhancer = ImageEnhance.Brightness(image)
-        image = enhancer.enhance(random.uniform(1.01, 1.02))
+def _finish_page(
+    image,
+    image_quality,
+    askew,
+    black_and_white,
+    blur,
+    contrast,
+    sharpness,
+    brightness,
+    fast_path,
+    optimize,
+):
+    """Apply the scan effects to a rendered pdf page and return it as JPEG bytes"""
+    if not fast_path:
+        image = _apply_effects(
+            image,
+            askew,
+            black_and_white,
+            blur,
+            contrast,
+            sharpness,
+            brightness,
+            max_angle=0.55,
+            # increase brightness a little bit
+            brightness_boost=random.choice(BRIGHTNESS_STEPS),
+        )
 
-        # Rotate every image by a small random angle
-        if askew:
-            image = rotate_image(image, random.uniform(-0.55, 0.55))
+    # Encode once at the requested quality, this is where the quality reduction happens
+    return _change_image_to_byte_buffer(image, image_quality, optimize)
 
-        # Make image black and white like a photocopy
-        if black_and_white:
-            image = black_and_white_image(image)
 
-        # Make image blurry
-        if blur:
-            image = blur_image(image)
-            
-        if contrast != 1.0:
-            image = change_contrast(image, contrast)
-        
-        # change image sharpness
-        if sharpness != 1.0:
-            image = change_sharpness(image, sharpness)
-            
-        # change image brightness
-        if brightness != 1.0:
-            image = change_brightness(image, brightness)
-
-        image = _change_image_to_byte_buffer(image)
-        images_list.append(image)
+def _scan_pdf_page(pdf_path, render_scale, page_index, **settings):
+    """
+    Open the given pdf file and scan only one of its pages.
+    Used by worker processes, since pdfium documents can't be shared between processes.
+    """
+    doc = _open_pdf(pdf_path)
+    try:
+        page = doc[page_index]
+        bitmap, image = _render_page(page, render_scale, settings["black_and_white"])
         page.close()
-    doc.close()
-    return images_list
+        try:
+            return _finish_page(image, **settings)
+        finally:
+            bitmap.close()
+    finally:
+        doc.close()
+
+
+def _iter_submitted(executor, function, items, depth):
+    """
+    Yield function(item) for every item in order, running function on the given executor.
+    At most depth items are submitted ahead of the caller, so finished results
+    can't pile up faster than the caller consumes them.
+    """
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(function, item))
+        if len(pending) >= depth:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _iter_finished_pages(doc, render_scale, black_and_white, finish_page, depth=2):
+    """
+    Render the pages of an open pdf document one by one and yield finish_page(image)
+    for every page in order, running finish_page on a background thread.
+    While the thread finishes one page the next one is rendered,
+    with at most depth pages waiting at any time.
+    Every bitmap is closed here once its page is finished, so no pdfium call,
+    freeing a bitmap included, runs on the background thread.
+    """
+    pending = deque()
+
+    def finish_oldest():
+        bitmap, future = pending[0]
+        result = future.result()
+        pending.popleft()
+        bitmap.close()
+        return result
+
+    try:
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            for page in doc:
+                bitmap, image = _render_page(page, render_scale, black_and_white)
+                page.close()
+                pending.append((bitmap, executor.submit(finish_page, image)))
+                if len(pending) >= depth:
+                    yield finish_oldest()
+            while pending:
+                yield finish_oldest()
+    finally:
+        # The executor has shut down, so nothing uses the remaining bitmaps anymore
+        for bitmap, _ in pending:
+            bitmap.close()
+
+
+def _iter_scanned_pages(
+    pdf_path,
+    image_quality=100,
+    askew=True,
+    black_and_white=False,
+    blur=False,
+    contrast=1.0,
+    sharpness=1.0,
+    brightness=1.0,
+    render_scale=2.0,
+    max_workers=None,
+    optimize=True,
+):
+    """
+    Reads given pdf file page by page and yields every page as scanned JPEG bytes.
+    Multi-page files are scanned in parallel worker processes, pages are still yielded in order.
+    Otherwise pages are rendered here and finished on a background thread.
+    """
+    settings = {
+        "image_quality": image_quality,
+        "askew": askew,
+        "black_and_white": black_and_white,
+        "blur": blur,
+        "contrast": contrast,
+        "sharpness": sharpness,
+        "brightness": brightness,
+        "optimize": optimize,
+        # Without effects, pages only need to be rendered and encoded
+        "fast_path": not _has_effects(
+            askew, black_and_white, blur, contrast, sharpness, brightness
+        ),
+    }
+
+    doc = _open_pdf(pdf_path)
+    page_count = len(doc)
+    workers = min(max_workers or os.cpu_count() or 1, page_count)
+    if workers > 1:
+        doc.close()
+        scan_page = functools.partial(_scan_pdf_page, pdf_path, render_scale, **settings)
+        # Reseed every worker, so forked processes don't share the same random angles
+        with ProcessPoolExecutor(max_workers=workers, initializer=random.seed) as executor:
+            # Keep every worker busy, without holding more than a few finished pages in memory
+            yield from _iter_submitted(executor, scan_page, range(page_count), 2 * workers)
+        return
+
+    # pdfium calls must stay on this thread, so only the effects and JPEG encoding
+    # of each page run in the background while the next page is being rendered
+    try:
+        finish_page = functools.partial(_finish_page, **settings)
+        yield from _iter_finished_pages(doc, render_scale, black_and_white, finish_page)
+    finally:
+        doc.close()
 
 
-def _save_image_obj_to_pdf(images_list, output_pdf_path, pdf_version=17):
+def _save_image_obj_to_pdf(images, output_pdf_path, pdf_version=17, render_scale=2.0):
     """
-    Save image objects into output pdf
+    Save image objects into output pdf, given as a file path or a writable binary buffer.
+    Accepts any iterable of JPEG bytes and writes every page as soon as it is received.
+    Page size is the image size divided by the scale the images were rendered at.
+    Nothing is printed here, since this also runs in worker processes,
+    where quiet mode can't redirect the output.
     """
     pages_scanned = 0
-    if images_list:
-        output_pdf = pdfium.PdfDocument.new()
-        for image_file in images_list:
+    output_pdf = pdfium.PdfDocument.new()
+    try:
+        for image_data in images:
             pdf_image = pdfium.PdfImage.new(output_pdf)
-            pdf_image.load_jpeg(image_file)
+            # load inline so the JPEG data is released right away, not held until save
+            pdf_image.load_jpeg(io.BytesIO(image_data), inline=True)
             width, height = pdf_image.get_size()
-            # since render size increased by 2, decrease by same amount
-            width = width / 2
-            height = height / 2
+            # since render size was increased by the scale, decrease by same amount
+            width = width / render_scale
+            height = height / render_scale
 
             matrix = pdfium.PdfMatrix().scale(width, height)
             pdf_image.set_matrix(matrix)
@@ -392,11 +755,18 @@ def _save_image_obj_to_pdf(images_list, output_pdf_path, pdf_version=17):
             pdf_image.close()
             pages_scanned += 1
 
-        output_pdf.save(output_pdf_path, version=pdf_version)
+        if pages_scanned:
+            output_pdf.save(output_pdf_path, version=pdf_version)
+    finally:
         output_pdf.close()
+    return pages_scanned
+
+
+def _print_output_file(output_pdf_path, pages_scanned):
+    """Print the path and size of a saved output pdf file"""
+    if pages_scanned and isinstance(output_pdf_path, (str, os.PathLike)):
         file_size = get_file_size(output_pdf_path)
         print(f"{output_pdf_path=} {file_size=}")
-    return pages_scanned
 
 
 def _add_suffix(filename):
@@ -444,6 +814,70 @@ def _calc_energy_savings(pages_scanned):
         print_color(savings, "Green")
 
 
+def _iter_scanned_images(
+    input_image_list,
+    image_quality,
+    askew,
+    black_and_white,
+    blur,
+    contrast,
+    sharpness,
+    brightness,
+    optimize=True,
+):
+    """
+    Reads given image files one by one and yields every image as scanned JPEG bytes.
+    Files that can't be converted are reported and skipped.
+    """
+    # Decide once whether any effect applies, instead of for every image
+    has_effects = _has_effects(
+        askew, black_and_white, blur, contrast, sharpness, brightness
+    )
+    # JPEG files can be used as they are if they don't need to change at all
+    passthrough = not has_effects and image_quality >= 95
+    for image_path in input_image_list:
+        if files_exists(image_path):
+            try:
+                with Image.open(image_path) as image:
+                    # opening only reads the header, so this check costs no decoding
+                    use_file = (
+                        passthrough
+                        and image.format == "JPEG"
+                        and image.mode in ("RGB", "L")
+                    )
+                    if use_file:
+                        with open(image_path, "rb") as file:
+                            image_data = file.read()
+                        # a truncated file is decoded like any other image instead,
+                        # so it's reported and skipped rather than embedded as a broken page
+                        use_file = image_data.endswith(b"\xff\xd9")
+                    if not use_file:
+                        image = flatten_image(image)
+
+                if use_file:
+                    # embed the original JPEG data without decoding and encoding it again
+                    image = image_data
+                else:
+                    if has_effects:
+                        image = _apply_effects(
+                            image,
+                            askew,
+                            black_and_white,
+                            blur,
+                            contrast,
+                            sharpness,
+                            brightness,
+                            max_angle=0.75,
+                        )
+
+                    # Encode once at the requested quality
+                    image = _change_image_to_byte_buffer(image, image_quality, optimize)
+            except Exception as err:
+                print_color(f"Error converting file {image_path} :- {err}", "Red")
+                continue
+            yield image
+
+
 def convert_images_to_pdf(
     input_image_list,
     image_quality,
@@ -452,74 +886,156 @@ def convert_images_to_pdf(
     blur,
     contrast,
     sharpness,
-    brightness
+    brightness,
+    optimize=True,
 ):
     """Converts all image files in a folder to PDF"""
-    images_list = []
     output_pdf_path = None
     if input_image_list:
         # Output pdf name will be the fetched from first Image's name
         output_pdf_path = os.path.splitext(input_image_list[0])[0] + "_output.pdf"
-        for image_path in input_image_list:
-            if files_exists(image_path):
-                try:
-                    image = Image.open(image_path)
-                    image = image.convert("RGB")
-
-                    # reduce image quality a little bit
-                    image = reduce_image_quality(image, image_quality)
-
-                    # Rotate every image by a small random angle
-                    if askew:
-                        image = rotate_image(image, random.uniform(-0.75, 0.75))
-
-                    # Make image black and white like a photocopy
-                    if black_and_white:
-                        image = black_and_white_image(image)
-
-                    # Make image blurry
-                    if blur:
-                        image = blur_image(image)
-                    
-                    # change image contrast
-                    if contrast != 1.0:
-                        image = change_contrast(image, contrast)
-                    
-                    # change image sharpness
-                    if sharpness != 1.0:
-                        image = change_sharpness(image, sharpness)
-                        
-                    # change image brightness
-                    if brightness != 1.0:
-                        image = change_brightness(image, brightness)
-
-                    image = _change_image_to_byte_buffer(image)
-                    images_list.append(image)
-                except Exception as err:
-                    print_color(f"Error converting file {image_path} :- {err}", "Red")
-
-        pages_scanned = _save_image_obj_to_pdf(images_list, output_pdf_path)
+        images = _iter_scanned_images(
+            input_image_list,
+            image_quality,
+            askew,
+            black_and_white,
+            blur,
+            contrast,
+            sharpness,
+            brightness,
+            optimize=optimize,
+        )
+        # Every image is written to the output pdf as soon as it is converted
+        pages_scanned = _save_image_obj_to_pdf(images, output_pdf_path)
+        _print_output_file(output_pdf_path, pages_scanned)
         _calc_energy_savings(pages_scanned)
     return output_pdf_path
 
 
-def convert_pdf_to_scanned(pdf_list, image_quality, askew, black_and_white, blur, contrast, sharpness, brightness):
+def _process_one_pdf(
+    pdf_path,
+    image_quality,
+    askew,
+    black_and_white,
+    blur,
+    contrast,
+    sharpness,
+    brightness,
+    render_scale=2.0,
+    max_workers=None,
+    optimize=True,
+    output=None,
+):
+    """
+    Converts one PDF file into a scanned PDF file.
+    The output is saved next to the input file, or into the given writable buffer.
+    Returns the output file path or buffer and the number of pages scanned.
+    """
+    output_path = _add_suffix(pdf_path) if output is None else output
+    images = _iter_scanned_pages(
+        pdf_path,
+        image_quality,
+        askew,
+        black_and_white,
+        blur,
+        contrast,
+        sharpness,
+        brightness,
+        render_scale=render_scale,
+        max_workers=max_workers,
+        optimize=optimize,
+    )
+    pages_scanned = _save_image_obj_to_pdf(images, output_path, render_scale=render_scale)
+    return output_path, pages_scanned
+
+
+def convert_pdf_to_scanned(
+    pdf_list,
+    image_quality,
+    askew,
+    black_and_white,
+    blur,
+    contrast,
+    sharpness,
+    brightness,
+    optimize=True,
+    max_workers=None,
+    render_scale=None,
+    outputs=None,
+):
     """
-    Converts PDF files into scanned PDF files
+    Converts PDF files into scanned PDF files.
+    Several files are converted in parallel worker processes, one file per worker,
+    while a single file has its pages scanned in parallel instead.
+    Pages are rendered at the given scale, or at the scale that fits the output quality.
+    If a list of writable buffers is given as outputs, one for every input file,
+    scanned files are saved into them and the buffers are returned instead of file paths.
+    A None entry in outputs saves that file to disk as usual.
+    Buffered files are converted in this process, while files saved to disk still share the pool.
     """
+    if outputs is None:
+        outputs = [None] * len(pdf_list)
+    elif len(outputs) != len(pdf_list):
+        raise ValueError(
+            f"Expected one output buffer for every input file, "
+            f"got {len(outputs)} for {len(pdf_list)} files"
+        )
+
     output_file_list = []
     pages_scanned = 0
-    for pdf_path in pdf_list:
-        if files_exists(pdf_path):
-            try:
-                output_path = _add_suffix(pdf_path)
-                images = _convert_pdf_pages_to_jpg_list(
-                    pdf_path, image_quality, askew, black_and_white, blur, contrast, sharpness, brightness
+    render_scale = render_scale or _get_render_scale(image_quality)
+    files = [
+        (pdf_path, output)
+        for pdf_path, output in zip(pdf_list, outputs)
+        if files_exists(pdf_path)
+    ]
+    process_one_pdf = functools.partial(
+        _process_one_pdf,
+        image_quality=image_quality,
+        askew=askew,
+        black_and_white=black_and_white,
+        blur=blur,
+        contrast=contrast,
+        sharpness=sharpness,
+        brightness=brightness,
+        render_scale=render_scale,
+        optimize=optimize,
+    )
+
+    executor = None
+    # Buffers can't be written from other processes, so only files saved to disk share the pool
+    disk_files = [pdf_path for pdf_path, output in files if output is None]
+    workers = min(max_workers or os.cpu_count() or 1, len(disk_files))
+    if workers > 1:
+        # Reseed every worker, so forked processes don't share the same random angles
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=random.seed)
+    jobs = []
+    for pdf_path, output in files:
+        if executor and output is None:
+            # Every worker scans the pages of its file itself, so the pools don't oversubscribe
+            jobs.append(executor.submit(process_one_pdf, pdf_path, max_workers=1).result)
+        else:
+            # Buffered files are converted here, one page at a time while the pool is busy
+            page_workers = 1 if executor else max_workers
+            jobs.append(
+                functools.partial(
+                    process_one_pdf, pdf_path, max_workers=page_workers, output=output
                 )
-                pages_scanned += _save_image_obj_to_pdf(images, output_path)
+            )
+
+    try:
+        for (pdf_path, _), job in zip(files, jobs):
+            try:
+                output_path, pages = job()
+                # Printed here rather than in the worker, so quiet mode applies to it
+                _print_output_file(output_path, pages)
+                pages_scanned += pages
                 output_file_list.append(output_path)
             except Exception as err:
                 print_color(f"Error converting file {pdf_path} :- {err}", "Red")
+    finally:
+        if executor:
+            executor.shutdown()
 
     _calc_energy_savings(pages_scanned)
     return output_file_list
@@ -531,29 +1047,40 @@ def print_version():
     print_color(f"Scanner version: {version}", "Green")
 
 
+def _print_folder_error(err):
+    """Report a folder that could not be read while searching for files"""
+    if isinstance(err, FileNotFoundError):
+        print_color(f"Input folder not found: {err.filename}", "red")
+    elif isinstance(err, PermissionError):
+        print_color(f"Permission denied: {err.filename}", "red")
+    else:
+        print_color(f"Error when searching for files: {err}", "red")
+
+
 def find_matching_files(input_folder, file_type_list, recurse=False, sort_key=None):
     """
     Find files in the given input folder and filter only matching file types.
     If recurse is True, this method will identify all matching files in all subdirectories.
     """
     files_list = []
-    try:
-        path = Path(input_folder)
-        for file in path.iterdir():
-            if file.is_file():
-                # checks if file in given folder contains expected file types
-                sfx = file.suffix.lower().lstrip(".")
-                file_in_list = (file.name in file_type_list) or (sfx in file_type_list)
-                if file_in_list:
-                    files_list.append(str(file.absolute()))
-            elif recurse and file.is_dir():
-                files_list.extend(find_matching_files(file, file_type_list, recurse))
-    except FileNotFoundError:
-        print_color(f"Input folder not found: {input_folder}", "red")
-    except PermissionError:
-        print_color(f"Permission denied: {input_folder}", "red")
-    except Exception as err:
-        print_color(f"Error when searching for files: {err}", "red")
+    file_types = set(file_type_list)
+    folders = deque([os.path.abspath(input_folder)])
+
+    while folders:
+        folder = folders.popleft()
+        try:
+            # scandir entries cache the file type, so no extra stat call is made per file
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        # checks if file in given folder contains expected file types
+                        sfx = os.path.splitext(entry.name)[1].lstrip(".").lower()
+                        if entry.name in file_types or sfx in file_types:
+                            files_list.append(entry.path)
+                    elif recurse and entry.is_dir(follow_symlinks=False):
+                        folders.append(entry.path)
+        except OSError as err:
+            _print_folder_error(err)
 
     # Sort the list of files if sorting is requested by user
     if sort_key:
@@ -564,11 +1091,22 @@ def find_matching_files(input_folder, file_type_list, recurse=False, sort_key=No
 
 def sort_by_top_level_directory(path):
     """Method to help sort file paths based on level"""
-    directories = path.split(os.path.sep)
-    return len(directories)
+    return path.count(os.path.sep)
 
 
-def convert_and_save(files_list, doc_type, quality, askew, black_and_white, blur, contrast, sharpness, brightness):
+def convert_and_save(
+    files_list,
+    doc_type,
+    quality,
+    askew,
+    black_and_white,
+    blur,
+    contrast,
+    sharpness,
+    brightness,
+    optimize=True,
+    render_scale=None,
+):
     """Convert input files into necessary output document format"""
     pdf_path = None
 
@@ -578,11 +1116,28 @@ def convert_and_save(files_list, doc_type, quality, askew, black_and_white, blur
     # Convert the files found into output files
     if doc_type == "image":
         pdf_path = convert_images_to_pdf(
-            files_list, quality, askew, black_and_white, blur, contrast, sharpness, brightness
+            files_list,
+            quality,
+            askew,
+            black_and_white,
+            blur,
+            contrast,
+            sharpness,
+            brightness,
+            optimize=optimize,
         )
     elif doc_type == "pdf":
         pdf_path = convert_pdf_to_scanned(
-            files_list, quality, askew, black_and_white, blur, contrast, sharpness, brightness
+            files_list,
+            quality,
+            askew,
+            black_and_white,
+            blur,
+            contrast,
+            sharpness,
+            brightness,
+            optimize=optimize,
+            render_scale=render_scale,
         )
     else:
         print_color("Error: Unsupported file format!", "Red")
@@ -594,10 +1149,28 @@ def convert_and_save(files_list, doc_type, quality, askew, black_and_white, blur
         print_color("No matching files found. No output documents generated!\n", "Red")
 
 
-def main():
-    """Get input arguments and run the script"""
+def main(argv=None):
+    """
+    Get input arguments and run the script.
+    The command-line is parsed once, and every setting is read from that result.
+    """
+    args = parse_args(argv)
+    if get_quiet(args):
+        # Progress and summaries are printed to stdout, errors are moved to stderr
+        errors_to_stderr = _ERRORS_TO_STDERR.set(True)
+        try:
+            with open(os.devnull, "w", encoding="utf-8") as devnull:
+                with contextlib.redirect_stdout(devnull):
+                    run(args)
+        finally:
+            _ERRORS_TO_STDERR.reset(errors_to_stderr)
+    else:
+        run(args)
+
+
+def run(args):
+    """Convert the matching files with the parsed command-line arguments"""
     print_version()
-    args = parse_args()
 
     # Gather input arguments from command-line
     input_folder = get_input_folder(args)
@@ -609,24 +1182,38 @@ def main():
     contrast = get_contrast(args)
     sharpness = get_sharpness(args)
     brightness = get_brightness(args)
+    optimize = get_optimize(args)
+    render_scale = get_render_scale(args)
     sort_key = get_sort_key(args)
     doc_type, file_type_list = get_file_type(args)
 
     print_color(
         f"{quality=} {recurse=} {askew=} "
         f"{black_and_white=} {blur=} {contrast=} "
-        f"{sharpness=} {brightness=} {doc_type=} "
-        f"{sort_key=} {file_type_list=}",
+        f"{sharpness=} {brightness=} {optimize=} {render_scale=} "
+        f"{doc_type=} {sort_key=} {file_type_list=}",
         "Cyan",
     )
 
     # Gather the input files based on the arguments
     files_list = find_matching_files(input_folder, file_type_list, recurse, sort_key)
     # Sort file paths so output gets saved in top level directory
-    files_list = sorted(files_list, key=sort_by_top_level_directory)
+    files_list.sort(key=sort_by_top_level_directory)
 
     # Convert input files to look like scanned
-    convert_and_save(files_list, doc_type, quality, askew, black_and_white, blur, contrast, sharpness, brightness)
+    convert_and_save(
+        files_list,
+        doc_type,
+        quality,
+        askew,
+        black_and_white,
+        blur,
+        contrast,
+        sharpness,
+        brightness,
+        optimize=optimize,
+        render_scale=render_scale,
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,48 @@
+"""Shared fixtures for the scanner tests"""
+import io
+import os
+import pytest
+from PIL import Image
+import pypdfium2 as pdfium
+
+# Import the scanner while conftest loads, so its dependencies are loaded once before collection
+import scanner.scanner  # pylint: disable=unused-import
+
+
+@pytest.fixture(scope="session", autouse=True)
+def warm_up_libraries():
+    """
+    Load pdfium and the PIL JPEG codec once per test session or xdist worker,
+    so their one-time setup isn't charged to whichever test runs first.
+    """
+    pdf = pdfium.PdfDocument.new()
+    page = pdf.new_page(1, 1)
+    page.render().close()
+    page.close()
+    pdf.close()
+    Image.new("RGB", (1, 1), "white").save(io.BytesIO(), format="JPEG")
+
+
+def is_pdf_valid(file_path, min_size=0):
+    """
+    Check if given PDF file is valid by checking the header of the PDF file.
+    The file is read through its descriptor: one open call covers the size and header checks,
+    without building a Python file object.
+    """
+    try:
+        # O_BINARY only exists on Windows, where files open in text mode otherwise
+        file_descriptor = os.open(file_path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+    except OSError:
+        return False
+    try:
+        if os.fstat(file_descriptor).st_size <= min_size:
+            return False
+        return os.read(file_descriptor, 5).startswith(b"%PDF-")
+    finally:
+        os.close(file_descriptor)
+
+
+@pytest.fixture(name="is_pdf_valid")
+def fixture_is_pdf_valid():
+    """Provide the PDF validity check to every test module"""
+    return is_pdf_valid
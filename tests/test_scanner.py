@@ -1,44 +1,444 @@
 """Script to test scanner package"""
+import io
 import os
+import random
+import shutil
+import subprocess
+import sys
+import threading
+from argparse import Namespace
+from concurrent.futures import ThreadPoolExecutor
 import pytest
-from scanner.scanner import convert_images_to_pdf, convert_pdf_to_scanned
+from PIL import Image, ImageEnhance
+import pypdfium2 as pdfium
+from scanner.scanner import (
+    SUPPORTED_DOCS,
+    SUPPORTED_IMAGES,
+    _apply_effects,
+    _iter_scanned_pages,
+    _iter_submitted,
+    change_brightness,
+    change_contrast,
+    convert_images_to_pdf,
+    convert_pdf_to_scanned,
+    find_matching_files,
+    get_file_type,
+    get_sort_key,
+    main,
+    reduce_image_quality,
+)
 
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(TEST_DIR)
 
-def is_pdf_valid(file_path):
-    """Check if given PDF file is valid by checking the header of the PDF file"""
+
+def link_or_copy(source, destination):
+    """
+    Hard link the file when possible, since tests only read their input files.
+    Falls back to a copy when the temporary folder is on another file system.
+    """
     try:
-        with open(file_path, "rb") as file:
-            header = file.read(4)
-            return header == b"%PDF"
-    except IOError:
-        return False
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+    return destination
+
+
+def list_test_files(file_types):
+    """Return the names of the test input files with one of the given extensions"""
+    with os.scandir(TEST_DIR) as entries:
+        return sorted(
+            entry.name
+            for entry in entries
+            if entry.is_file() and entry.name.rpartition(".")[2].lower() in file_types
+        )
+
+
+def stage(file_name, folder):
+    """Place a single test input file into the given folder and return its path"""
+    return link_or_copy(os.path.join(TEST_DIR, file_name), os.path.join(folder, file_name))
+
+
+@pytest.fixture(name="test_dir")
+def fixture_test_dir(tmp_path):
+    """
+    Copy the test input files into a temporary folder.
+    Every test writes its outputs there, so tests can run in parallel.
+    """
+    shutil.copytree(
+        TEST_DIR,
+        tmp_path,
+        dirs_exist_ok=True,
+        ignore=shutil.ignore_patterns("*.py", "__pycache__"),
+        copy_function=link_or_copy,
+    )
+    return tmp_path
+
+
+CORRUPT_PDF = "Test_pdf_Corrupt.pdf"
+SAMPLE_PDFS = [name for name in list_test_files(SUPPORTED_DOCS) if name != CORRUPT_PDF]
+
 
+@pytest.fixture(scope="session", name="scanned_images_pdf")
+def fixture_scanned_images_pdf(tmp_path_factory):
+    """Convert the sample images once per session and share the output pdf between tests"""
+    folder = tmp_path_factory.mktemp("images")
+    test_files = [stage("Test_image_JPG.jpg", folder), stage("Test_image_Webp.webp", folder)]
+    return convert_images_to_pdf(test_files, 90, False, False, False, 0.5, 0.75, 2)
 
-def test_convert_images_to_pdf():
+
+@pytest.fixture(scope="session", name="scanned_pdfs")
+def fixture_scanned_pdfs(tmp_path_factory):
+    """
+    Convert the sample pdf files once per session and share the output pdfs between tests.
+    Returns the folder the files were converted in, and the output paths by their file names.
+    """
+    folder = tmp_path_factory.mktemp("pdfs")
+    test_files = [stage(file, folder) for file in list_test_files(SUPPORTED_DOCS)]
+    output_files = convert_pdf_to_scanned(test_files, 90, True, True, True, 0.5, 0.75, 2)
+    return folder, {os.path.basename(output_pdf): output_pdf for output_pdf in output_files}
+
+
+@pytest.mark.slow
+def test_convert_images_to_pdf(scanned_images_pdf, is_pdf_valid):
     """Test converting images to PDF"""
-    test_files = ["./tests/Test_image_JPG.jpg", "./tests/Test_image_Webp.webp"]
-    output_pdf = convert_images_to_pdf(test_files, 90, False, False, False, 0.5, 0.75, 2)
-    print(output_pdf)
+    output_pdf = scanned_images_pdf
     assert output_pdf.endswith(".pdf")
-    assert os.path.exists(output_pdf)
-    assert os.stat(output_pdf).st_size > 100
+    assert is_pdf_valid(output_pdf, min_size=100)
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize("pdf_name", SAMPLE_PDFS)
+def test_convert_pdf_to_scanned(scanned_pdfs, pdf_name, is_pdf_valid):
+    """Test converting PDF to scanned output, checking every sample file on its own"""
+    base_name, extension = pdf_name.rsplit(".", 1)
+    _, output_pdfs = scanned_pdfs
+    output_pdf = output_pdfs[f"{base_name}_output.{extension}"]
+    assert output_pdf.endswith((".pdf", ".PDF"))
+    assert is_pdf_valid(output_pdf, min_size=100)
+
+
+@pytest.mark.slow
+def test_convert_corrupt_pdf_to_scanned(scanned_pdfs):
+    """Test that a corrupt PDF is skipped without an output file"""
+    folder, output_pdfs = scanned_pdfs
+    output_name = CORRUPT_PDF.replace(".pdf", "_output.pdf")
+    assert output_name not in output_pdfs
+    assert not (folder / output_name).exists()
+
+
+def test_convert_pdf_to_scanned_buffer():
+    """Test saving a scanned PDF into an in-memory buffer instead of a file"""
+    buffer = io.BytesIO()
+    test_file = os.path.join(TEST_DIR, "Test_pdf.pdf")
+    output_files = convert_pdf_to_scanned(
+        [test_file], 50, False, False, False, 1.0, 1.0, 1.0, outputs=[buffer]
+    )
+    assert output_files == [buffer]
+    assert buffer.getvalue().startswith(b"%PDF-")
+    assert not os.path.exists(os.path.join(TEST_DIR, "Test_pdf_output.pdf"))
+
+
+@pytest.mark.slow
+def test_convert_pdf_to_scanned_mixed_outputs(tmp_path, is_pdf_valid):
+    """Test a batch that saves some files into buffers and the others to disk"""
+    buffer = io.BytesIO()
+    file_names = ("Test_pdf.pdf", "Test_pdf_A4.PDF", "Test_pdf_Letter.pdf")
+    test_files = [stage(file, tmp_path) for file in file_names]
+    output_files = convert_pdf_to_scanned(
+        test_files, 50, False, False, False, 1.0, 1.0, 1.0,
+        max_workers=2, outputs=[buffer, None, None],
+    )
+    assert output_files[0] is buffer
+    assert buffer.getvalue().startswith(b"%PDF-")
+    assert not (tmp_path / "Test_pdf_output.pdf").exists()
+    assert all(is_pdf_valid(output_pdf, min_size=100) for output_pdf in output_files[1:])
+
+
+def test_convert_pdf_to_scanned_buffer_count():
+    """Test that every input file needs its own output buffer"""
+    test_files = [os.path.join(TEST_DIR, "Test_pdf.pdf"), os.path.join(TEST_DIR, "Test_pdf_A4.PDF")]
+    with pytest.raises(ValueError):
+        convert_pdf_to_scanned(
+            test_files, 50, False, False, False, 1.0, 1.0, 1.0, outputs=[io.BytesIO()]
+        )
+
+
+@pytest.mark.parametrize(
+    "file_type_or_name, expected",
+    [
+        (None, ("pdf", SUPPORTED_DOCS)),
+        ("image", ("image", SUPPORTED_IMAGES)),
+        ("PNG", ("image", ["png"])),
+        (".jpeg", ("image", ["jpeg"])),
+        ("Test_image_JPG.jpg", ("image", ["Test_image_JPG.jpg"])),
+        ("pdf", ("pdf", ["pdf"])),
+        ("Test_pdf_A4.PDF", ("pdf", ["Test_pdf_A4.PDF"])),
+        ("pg", ("pdf", SUPPORTED_DOCS)),
+    ],
+)
+def test_get_file_type(file_type_or_name, expected):
+    """Test file type detection from the -f argument"""
+    args = Namespace(file_type_or_name=file_type_or_name)
+    assert get_file_type(args) == expected
+
+
+def test_find_matching_files(tmp_path):
+    """Test that only matching files are found, in sub folders only when recursing"""
+    sub_folder = tmp_path / "sub"
+    sub_folder.mkdir()
+    for path in (tmp_path / "a.pdf", tmp_path / "b.PDF", tmp_path / "c.txt", sub_folder / "d.pdf"):
+        path.write_bytes(b"")
+
+    found = find_matching_files(str(tmp_path), SUPPORTED_DOCS, False, os.path.basename)
+    assert [os.path.basename(path) for path in found] == ["a.pdf", "b.PDF"]
+
+    found = find_matching_files(str(tmp_path), SUPPORTED_DOCS, True, os.path.basename)
+    assert [os.path.basename(path) for path in found] == ["a.pdf", "b.PDF", "d.pdf"]
+
+
+def test_find_matching_files_sorted_by_mtime(tmp_path):
+    """Test that files are sorted by modified time when requested"""
+    now = 1_700_000_000
+    for offset, name in enumerate(["b.pdf", "c.pdf", "a.pdf"]):
+        path = tmp_path / name
+        path.write_bytes(b"")
+        # set the times directly, so the test doesn't wait for the clock to move on
+        os.utime(path, (now + offset, now + offset))
+
+    sort_key = get_sort_key(Namespace(sort_by="mtime"))
+    found = find_matching_files(str(tmp_path), SUPPORTED_DOCS, False, sort_key)
+    assert [os.path.basename(path) for path in found] == ["b.pdf", "c.pdf", "a.pdf"]
+
+
+def test_iter_submitted_limits_work_in_flight():
+    """Test that results come back in order with only a few items submitted ahead"""
+    submitted = []
+
+    def record(item):
+        submitted.append(item)
+        return item * 2
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        results = _iter_submitted(executor, record, range(10), 4)
+        assert next(results) == 0
+        assert len(submitted) <= 4
+        assert list(results) == [value * 2 for value in range(1, 10)]
+
+
+def test_iter_scanned_pages_destroys_bitmaps_on_render_thread(monkeypatch):
+    """Test that pdfium bitmaps are destroyed by the rendering thread, not the encoding thread"""
+    destroyed_on = []
+    destroy_bitmap = pdfium.raw.FPDFBitmap_Destroy
+
+    def record_destroy(bitmap):
+        destroyed_on.append(threading.get_ident())
+        destroy_bitmap(bitmap)
+
+    monkeypatch.setattr(pdfium.raw, "FPDFBitmap_Destroy", record_destroy)
+    test_file = os.path.join(TEST_DIR, "Test_pdf_Letter.pdf")
+    pages = list(_iter_scanned_pages(test_file, 50, askew=False, max_workers=1))
+    assert pages and all(page.startswith(b"\xff\xd8") for page in pages)
+    assert destroyed_on == [threading.get_ident()] * len(pages)
+
+
+@pytest.mark.parametrize("mode", ["L", "RGB"])
+@pytest.mark.parametrize("contrast, brightness", [(1.2, 1.0), (1.2, 1.1), (1.37, 0.9), (0.75, 1.015)])
+def test_change_contrast_matches_image_enhance(mode, contrast, brightness):
+    """Test that the lookup tables give the same levels as Pillow's enhancers"""
+    image = Image.effect_noise((64, 64), 80).convert(mode)
+    expected = ImageEnhance.Contrast(image).enhance(contrast)
+    expected = ImageEnhance.Brightness(expected).enhance(brightness)
+    assert change_contrast(image, contrast, brightness).tobytes() == expected.tobytes()
+    expected = ImageEnhance.Brightness(image).enhance(brightness)
+    assert change_brightness(image, brightness).tobytes() == expected.tobytes()
+
+
+def test_reduce_image_quality():
+    """Test that the image is encoded as a JPEG and opened again"""
+    image = Image.effect_noise((64, 64), 80).convert("RGB")
+    reduced_image = reduce_image_quality(image, 50)
+    assert reduced_image.format == "JPEG"
+    assert reduced_image.size == image.size
+    assert reduced_image.tobytes() != image.tobytes()
+
+
+def test_apply_effects_askew(monkeypatch):
+    """Test that askew keeps the image size and is skipped entirely when disabled"""
+    image = Image.new("RGB", (10, 10), "white")
+    assert _apply_effects(image, True, False, False, 1.0, 1.0, 1.0).size == (10, 10)
+
+    def no_random(*args):
+        raise AssertionError("random angle drawn without askew")
+
+    monkeypatch.setattr(random, "uniform", no_random)
+    assert _apply_effects(image, False, False, False, 1.0, 1.0, 1.0) is image
+
+
+def test_convert_transparent_image_to_pdf(tmp_path, is_pdf_valid):
+    """Test that transparent areas of an image end up white in the PDF"""
+    image_path = str(tmp_path / "transparent.png")
+    Image.new("RGBA", (8, 8), (0, 0, 0, 0)).save(image_path)
+    output_pdf = convert_images_to_pdf([image_path], 95, False, False, False, 1.0, 1.0, 1.0)
     assert is_pdf_valid(output_pdf)
 
+    # the page is tiny, so render it at its own size and read the centre pixel from the buffer
+    pdf = pdfium.PdfDocument(output_pdf)
+    try:
+        bitmap = pdf[0].render()
+        offset = bitmap.height // 2 * bitmap.stride + bitmap.width // 2 * bitmap.n_channels
+        centre_pixel = bytes(bitmap.buffer[offset : offset + 3])
+    finally:
+        pdf.close()
+    assert centre_pixel == b"\xff\xff\xff"
 
-def test_convert_pdf_to_scanned():
-    """Test converting PDF to scanned output"""
-    test_files = [
-        os.path.join("./tests", file)
-        for file in os.listdir("./tests")
-        if file.lower().endswith(".pdf")
-    ]
-    output_files = convert_pdf_to_scanned(test_files, 90, True, True, True, 0.5, 0.75, 2)
-    assert len(output_files) > 1
-    for i, output_pdf in enumerate(output_files):
-        assert output_pdf.lower().endswith(".pdf")
-        assert os.path.exists(output_pdf)
-        assert os.stat(output_pdf).st_size > 100
-        assert is_pdf_valid(output_pdf)
+
+def test_convert_truncated_jpeg_to_pdf(tmp_path, capsys):
+    """Test that a truncated JPEG is reported and skipped instead of embedded as it is"""
+    image = Image.effect_noise((64, 64), 64).convert("RGB")
+    image_paths = [str(tmp_path / "a_complete.jpg"), str(tmp_path / "b_truncated.jpg")]
+    for image_path in image_paths:
+        image.save(image_path, quality=95)
+    with open(image_paths[1], "r+b") as file:
+        file.truncate(os.path.getsize(image_paths[1]) // 2)
+
+    output_pdf = convert_images_to_pdf(image_paths, 95, False, False, False, 1.0, 1.0, 1.0)
+    assert "Error converting file" in capsys.readouterr().out
+    pdf = pdfium.PdfDocument(output_pdf)
+    try:
+        assert len(pdf) == 1
+    finally:
+        pdf.close()
+
+
+@pytest.mark.parametrize(
+    "cli_args, expected_outputs",
+    [
+        pytest.param(
+            ["-f", "pdf"],
+            ["Test_pdf_output.pdf", "Test_pdf_Letter_output.pdf"],
+            id="all_pdfs",
+            marks=pytest.mark.slow,
+        ),
+        pytest.param(
+            ["-f", "image", "-a", "no", "-s", "name"],
+            ["Test_image_JPG_output.pdf"],
+            id="images_without_askew",
+            marks=pytest.mark.slow,
+        ),
+        pytest.param(
+            ["-f", "Test_pdf_Letter.pdf", "-b", "yes", "-l", "yes"],
+            ["Test_pdf_Letter_output.pdf"],
+            id="black_and_white_blur",
+        ),
+        pytest.param(
+            ["-f", "png", "-c", "1.5", "-sh", "1.5", "-br", "1.2"],
+            ["Test_image_PNG_output.pdf"],
+            id="image_enhancements",
+            marks=pytest.mark.slow,
+        ),
+        pytest.param(
+            ["-f", "Test_pdf_A4.PDF", "-o", "no", "-rs", "1.5"],
+            ["Test_pdf_A4_output.PDF"],
+            id="render_scale_without_optimize",
+        ),
+    ],
+)
+def test_cli(test_dir, monkeypatch, is_pdf_valid, cli_args, expected_outputs):
+    """Test command-line conversions by calling main in the same process"""
+    # run from the staged folder, so the default input folder only holds the test files
+    monkeypatch.chdir(test_dir)
+    main(["-q", "50", "-qt", "yes"] + cli_args)
+    for output_pdf in expected_outputs:
+        assert is_pdf_valid(test_dir / output_pdf)
+
+
+def test_cli_recursive(tmp_path, is_pdf_valid):
+    """Test recursing into sub folders, on a small tree of its own"""
+    sub_folder = tmp_path / "sub"
+    sub_folder.mkdir()
+    stage("Test_pdf.pdf", sub_folder)
+    main(["-i", str(tmp_path), "-f", "pdf", "-r", "yes", "-q", "50", "-qt", "yes"])
+    assert is_pdf_valid(sub_folder / "Test_pdf_output.pdf")
+
+
+def test_cli_output(tmp_path, capsys):
+    """Test the messages printed by the command-line, and that quiet mode hides them"""
+    stage("Test_pdf.pdf", tmp_path)
+    main(["-i", str(tmp_path), "-f", "Test_pdf.pdf", "-q", "50"])
+    output = capsys.readouterr().out
+    assert "Matching Files Found: 1" in output
+    assert "You just saved" in output
+
+    main(["-i", str(tmp_path), "-f", "Test_pdf.pdf", "-q", "50", "-qt", "yes"])
+    assert capsys.readouterr().out == ""
+
+
+def test_cli_error_output(tmp_path, capsys):
+    """Test that errors are printed to stdout, and to stderr in quiet mode"""
+    stage(CORRUPT_PDF, tmp_path)
+    main(["-i", str(tmp_path), "-f", CORRUPT_PDF])
+    output = capsys.readouterr()
+    assert "Error converting file" in output.out
+    assert output.err == ""
+
+    main(["-i", str(tmp_path), "-f", CORRUPT_PDF, "-qt", "yes"])
+    output = capsys.readouterr()
+    assert output.out == ""
+    assert "Error converting file" in output.err
+
+
+# Spawned workers start with a fresh stdout, like on Windows and macOS
+QUIET_SPAWN_SCRIPT = """
+import multiprocessing, os, sys
+from scanner.scanner import main
+if __name__ == "__main__":
+    multiprocessing.set_start_method("spawn")
+    os.cpu_count = lambda: 2
+    main(sys.argv[1:])
+"""
+
+
+@pytest.mark.slow
+def test_cli_quiet_with_worker_processes(tmp_path, is_pdf_valid):
+    """Test that quiet mode also keeps worker processes from printing"""
+    stage("Test_pdf.pdf", tmp_path)
+    stage("Test_pdf_Letter.pdf", tmp_path)
+    result = subprocess.run(
+        [sys.executable, "-c", QUIET_SPAWN_SCRIPT]
+        + ["-i", str(tmp_path), "-f", "pdf", "-q", "50", "-qt", "yes"],
+        cwd=ROOT_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert result.stdout == ""
+    assert is_pdf_valid(tmp_path / "Test_pdf_output.pdf")
+    assert is_pdf_valid(tmp_path / "Test_pdf_Letter_output.pdf")
+
+
+def test_cli_help(capsys):
+    """Test the command-line help is printed and exits cleanly"""
+    with pytest.raises(SystemExit) as exit_info:
+        main(["-h"])
+    assert exit_info.value.code == 0
+    assert "usage" in capsys.readouterr().out
+
+
+@pytest.mark.slow
+def test_cli_convert_subprocess(tmp_path, is_pdf_valid):
+    """Test a conversion run as a script from start to end"""
+    stage("Test_pdf.pdf", tmp_path)
+    subprocess.run(
+        [sys.executable, "-m", "scanner.scanner"]
+        + ["-i", str(tmp_path), "-f", "Test_pdf.pdf", "-qt", "yes"],
+        cwd=ROOT_DIR,
+        # only the output file is checked, so the printed progress is discarded
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        check=True,
+    )
+    assert is_pdf_valid(tmp_path / "Test_pdf_output.pdf")
 
 
 # Run the tests